@@ -143,6 +143,19 @@ override_whitelisted_methods = {
 # 		"on_trash": "method"
 # 	}
 # }
+doc_events = {
+    "Stock Ledger Entry": {
+        "on_submit": "pos_mobile.pos_mobile.api.pos_stock.invalidate_stock_cache",
+        "on_cancel": "pos_mobile.pos_mobile.api.pos_stock.invalidate_stock_cache",
+    },
+    "POS Invoice": {
+        "on_submit": "pos_mobile.pos_mobile.api.pos_stock.invalidate_stock_cache",
+        "on_cancel": "pos_mobile.pos_mobile.api.pos_stock.invalidate_stock_cache",
+    },
+    "Stock Entry": {
+        "on_submit": "pos_mobile.pos_mobile.api.pos_stock.enqueue_stock_warmup",
+    },
+}
 
 # Scheduled Tasks
 # ---------------
@@ -164,6 +177,12 @@ override_whitelisted_methods = {
 # 		"pos_mobile.tasks.monthly"
 # 	],
 # }
+scheduler_events = {
+    # warms the POS stock cache in the hour before each opening hour in site_config (pos_mobile_stock_warmup_hours)
+    "hourly_long": [
+        "pos_mobile.pos_mobile.api.pos_stock.scheduled_stock_warmup",
+    ],
+}
 
 # Testing
 # -------
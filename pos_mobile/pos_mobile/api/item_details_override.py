@@ -8,8 +8,8 @@ lacks expected dict-like methods inside ERPNext utilities. It includes:
 
 1) A safe wrapper for update_stock to ensure a dict-like object is passed and
    fallbacks to values from ctx when needed.
-2) A safe wrapper for get_filtered_serial_nos to avoid iterating when doc/items
-   are absent.
+2) A safe, set-based replacement for get_filtered_serial_nos that avoids iterating
+   when doc/items are absent and filters in linear time otherwise.
 
 Do NOT import this in __init__.py. It is wired via a server hook (before_request)
 so it is applied at request time, not at module import.
@@ -87,37 +87,51 @@ def apply_item_details_patches() -> None:
             setattr(_safe_update_stock, "__pos_mobile_patched__", True)
             gid.update_stock = _safe_update_stock
 
-    # 2) Patch get_filtered_serial_nos to tolerate None/empty doc.items
+    # 2) Patch get_filtered_serial_nos to tolerate None/empty doc.items and filter via a set
     if not getattr(getattr(gid, "get_filtered_serial_nos", None), "__pos_mobile_patched__", False):
         _orig_get_filtered_serial_nos = getattr(gid, "get_filtered_serial_nos", None)
         if callable(_orig_get_filtered_serial_nos):
 
-            def _safe_get_filtered_serial_nos(serial_nos, doc=None):
-                """Safe wrapper around ERPNext's get_filtered_serial_nos.
+            def _safe_get_filtered_serial_nos(serial_nos, doc=None, table=None):
+                """Safe, set-based replacement for ERPNext's get_filtered_serial_nos.
 
                 If doc is None or doesn't provide an iterable `items` collection, do not attempt
                 to filter and simply return the provided serial numbers. This mirrors a
                 permissive behavior to avoid request failures.
+
+                Otherwise the serials already used by the doc's rows are collected into a set
+                once, and the candidates are filtered in a single pass (O(n + m) instead of a
+                list removal per cart serial). Candidate order is preserved.
                 """
                 try:
                     items = None
                     if doc is None:
                         items = None
                     elif isinstance(doc, dict):
-                        items = doc.get("items")
+                        items = doc.get(table or "items")
                     else:
                         # doc could be a Frappe Document or a proxy with .get
                         try:
-                            items = doc.get("items")
+                            items = doc.get(table or "items")
                         except Exception:
                             items = None
 
                     # If there are no items to filter against, return as-is
-                    if not items:
+                    if not items or not serial_nos:
                         return serial_nos
 
-                    # Delegate to original implementation when items are present
-                    return _orig_get_filtered_serial_nos(serial_nos, doc)
+                    used = set()
+                    for row in items:
+                        try:
+                            value = row.get("serial_no") if hasattr(row, "get") else getattr(row, "serial_no", None)
+                        except Exception:
+                            value = None
+                        if value:
+                            used.update(s.strip() for s in str(value).split("\n") if s.strip())
+
+                    if not used:
+                        return serial_nos
+                    return [s for s in serial_nos if s not in used]
                 except Exception:
                     # Be conservative; avoid crashing and return input
                     return serial_nos
@@ -0,0 +1,200 @@
+"""
+Admission control for the offline sync endpoints.
+
+When connectivity returns for a whole store every terminal replays its backlog
+at once. To keep live checkouts responsive we meter the sync endpoints with two
+Redis token buckets checked atomically in a single script:
+
+- a per-terminal bucket (user + client terminal id), so one terminal with a
+  large backlog cannot monopolise the server, and
+- a per-POS-Profile bucket, which bounds the total load a store can create.
+
+Backlog replays may only spend tokens above a reserved fraction of each bucket,
+so live sales always find headroom. Rejected calls get a ``retry_after`` hint
+(seconds) that clients should honor instead of their own backoff schedule.
+
+Limits are configurable from site_config.json, e.g.::
+
+    "pos_mobile_rate_limit": {
+        "enabled": 1,
+        "terminal": {"rate": 2, "burst": 10},
+        "profile": {"rate": 10, "burst": 40},
+        "backlog_reserve": 0.5
+    }
+"""
+
+import math
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import frappe
+
+PRIORITY_LIVE = "live"
+PRIORITY_BACKLOG = "backlog"
+
+DEFAULT_LIMITS: Dict[str, Any] = {
+    "enabled": 1,
+    # rate is tokens refilled per second, burst is bucket capacity
+    "terminal": {"rate": 2.0, "burst": 10.0},
+    "profile": {"rate": 10.0, "burst": 40.0},
+    # fraction of each bucket that backlog replays are not allowed to consume
+    "backlog_reserve": 0.5,
+}
+
+# Both buckets are refilled, checked and debited in one round trip so concurrent
+# workers never observe a half-applied decision.
+_TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local allowed = 1
+local wait = 0
+local state = {}
+for i = 1, #KEYS do
+    local base = 2 + (i - 1) * 3
+    local rate = tonumber(ARGV[base + 1])
+    local burst = tonumber(ARGV[base + 2])
+    local reserve = tonumber(ARGV[base + 3])
+    local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(data[1]) or burst
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens - cost < reserve then
+        allowed = 0
+        wait = math.max(wait, math.ceil(((cost + reserve) - tokens) * 1000 / rate))
+    end
+    state[i] = {tokens, rate, burst}
+end
+for i = 1, #KEYS do
+    local tokens = state[i][1]
+    if allowed == 1 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(state[i][3] * 1000 / state[i][2]) + 1000)
+end
+return {allowed, wait}
+"""
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9:_@.-]+$")
+
+
+def _get_limits() -> Dict[str, Any]:
+    limits = dict(DEFAULT_LIMITS)
+    try:
+        configured = frappe.conf.get("pos_mobile_rate_limit") or {}
+    except Exception:
+        configured = {}
+    if isinstance(configured, dict):
+        for key, value in configured.items():
+            if isinstance(value, dict) and isinstance(limits.get(key), dict):
+                limits[key] = {**limits[key], **value}
+            else:
+                limits[key] = value
+    return limits
+
+
+def normalize_priority(priority: Optional[str]) -> str:
+    """Anything that is not explicitly a backlog replay is treated as a live sale."""
+    return PRIORITY_BACKLOG if (priority or "").strip().lower() == PRIORITY_BACKLOG else PRIORITY_LIVE
+
+
+def _reserve_ratio(limits: Dict[str, Any]) -> float:
+    try:
+        return min(max(float(limits.get("backlog_reserve") or 0), 0.0), 0.95)
+    except Exception:
+        return 0.0
+
+
+def max_admissible_cost(priority: Optional[str] = None) -> int:
+    """
+    Largest cost a single call can be admitted with from full buckets.
+
+    Batch endpoints cap what they charge (and what they advertise to clients) at this
+    value; a larger cost would leave less than the backlog reserve and never pass.
+    """
+    limits = _get_limits()
+    reserve_ratio = _reserve_ratio(limits) if normalize_priority(priority) == PRIORITY_BACKLOG else 0.0
+    cost = None
+    for key in ("terminal", "profile"):
+        try:
+            burst = max(float((limits.get(key) or {}).get("burst") or 0), 1.0)
+        except Exception:
+            continue
+        # small epsilon so e.g. 10 * (1 - 0.5) does not floor to 4
+        allowed = int(math.floor(burst * (1 - reserve_ratio) + 1e-9))
+        cost = allowed if cost is None else min(cost, allowed)
+    return max(cost or 1, 1)
+
+
+def admit(
+    pos_profile: Optional[str] = None,
+    terminal_id: Optional[str] = None,
+    priority: Optional[str] = None,
+    cost: int = 1,
+    charge_terminal: bool = True,
+) -> Tuple[bool, int]:
+    """
+    Try to take `cost` tokens from the terminal and POS Profile buckets.
+
+    Callers that only learn the POS Profile after a lookup can admit in two steps:
+    first the terminal bucket alone (no `pos_profile`), then the profile bucket alone
+    (`charge_terminal=False`) once the profile is known.
+
+    Returns:
+        (allowed, retry_after) where retry_after is in whole seconds (0 when allowed).
+        Fails open (always allowed) when limiting is disabled or Redis is unavailable.
+    """
+    limits = _get_limits()
+    if not limits.get("enabled"):
+        return True, 0
+
+    try:
+        user = frappe.session.user
+    except Exception:
+        user = None
+    terminal = user or "Guest"
+    if terminal_id and _SAFE_ID.match(str(terminal_id)):
+        terminal = f"{terminal}:{terminal_id}"
+
+    is_backlog = normalize_priority(priority) == PRIORITY_BACKLOG
+    reserve_ratio = _reserve_ratio(limits)
+
+    buckets = [(f"terminal:{terminal}", limits["terminal"])] if charge_terminal else []
+    if pos_profile:
+        buckets.append((f"profile:{pos_profile}", limits["profile"]))
+
+    if not buckets:
+        return True, 0
+
+    try:
+        cache = frappe.cache()
+        keys = [cache.make_key(f"pos_admission:{name}") for name, _conf in buckets]
+        args: list = [int(time.time() * 1000), max(int(cost or 1), 1)]
+        for _name, conf in buckets:
+            rate = max(float(conf.get("rate") or 0), 0.001)
+            burst = max(float(conf.get("burst") or 0), 1.0)
+            args += [rate, burst, burst * reserve_ratio if is_backlog else 0]
+        allowed, wait_ms = cache.eval(_TOKEN_BUCKET_LUA, len(keys), *keys, *args)
+    except Exception:
+        return True, 0
+
+    if int(allowed):
+        return True, 0
+    return False, max(1, math.ceil(int(wait_ms) / 1000))
+
+
+def throttled_response(retry_after: int) -> Dict[str, Any]:
+    """Build the standard 'come back later' payload and expose Retry-After where supported."""
+    try:
+        headers = getattr(frappe.local, "response_headers", None)
+        if headers is not None:
+            headers["Retry-After"] = str(retry_after)
+    except Exception:
+        pass
+    return {
+        "ok": False,
+        "throttled": True,
+        "retry_after": retry_after,
+        "message": frappe._("Server busy, retry in {0}s").format(retry_after),
+    }
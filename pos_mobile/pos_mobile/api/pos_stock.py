@@ -1,31 +1,72 @@
 import json
+import time
+from datetime import timedelta
 from typing import Any, Dict, List, Optional, Union
 
 import frappe
-import hashlib
 from frappe import _
+from frappe.query_builder.functions import IfNull, Sum
+from frappe.utils import cint, flt, now_datetime
 
 from erpnext.accounts.doctype.pos_invoice.pos_invoice import get_stock_availability
 from erpnext.stock.get_item_details import get_pos_profile as _get_pos_profile
 
+# Upper bound on sales accepted by a single precheck_sales call
+MAX_PRECHECK_SALES = 500
 
-@frappe.whitelist()
-def get_available_qty(
-    item_codes: Union[str, List[str], None] = None,
-    pos_profile: Optional[str] = None,
-    warehouse: Optional[str] = None,
-) -> Dict[str, Dict[str, Any]]:
-    """
-    Batch API to fetch available stock quantity for multiple items for POS.
+# Upper bound on warehouses reported by get_multi_warehouse_qty
+MAX_AVAILABILITY_WAREHOUSES = 20
 
-    Args:
-        item_codes: List of Item Codes, or a JSON-encoded list of Item Codes. Optional; empty or missing returns {}.
-        pos_profile: POS Profile to derive context (optional; auto-resolved for current user if omitted).
-        warehouse: Ignored. Always resolved from the POS Profile.
+# Serials returned per item by get_available_serials
+DEFAULT_SERIAL_LIMIT = 20
+MAX_SERIAL_LIMIT = 200
 
-    Returns:
-        dict mapping item_code -> { actual_qty: number, is_stock_item: bool }
-    """
+# Per-item stock cache: one Redis hash per warehouse, field = item_code.
+# On-demand entries live briefly to keep near-real-time correctness while absorbing polling;
+# warm-up entries live longer and are invalidated by stock movements / POS submissions.
+STOCK_CACHE_TTL = 5
+DEFAULT_WARMUP_TTL = 900
+DEFAULT_WARMUP_ITEM_LIMIT = 5000
+# Store opening hours; the scheduled warm-up runs during the hour before each one
+DEFAULT_WARMUP_HOURS = [7]
+# Stock Entries with at least this many rows re-trigger a warm-up after submit
+DEFAULT_WARMUP_BULK_ROWS = 20
+WARMUP_CHUNK_SIZE = 500
+
+# Serial `sn.name` is held by a submitted, not yet consolidated POS Invoice of the given
+# is_return flag, either through its Serial and Batch Bundle or the legacy serial_no text
+# (mirrors ERPNext's get_pos_reserved_serial_nos: sold serials minus returned ones).
+_POS_SERIAL_HELD_SQL = """
+exists (
+    select 1
+    from `tabPOS Invoice Item` pii
+    join `tabPOS Invoice` pi on pi.name = pii.parent
+    left join `tabSerial and Batch Entry` sbe on sbe.parent = pii.serial_and_batch_bundle
+    where pi.docstatus = 1
+        and ifnull(pi.consolidated_invoice, '') = ''
+        and pi.is_return = {is_return}
+        and pii.item_code = sn.item_code
+        and pii.warehouse = sn.warehouse
+        and (
+            sbe.serial_no = sn.name
+            or concat(char(10), ifnull(pii.serial_no, ''), char(10)) like concat('%%', char(10), sn.name, char(10), '%%')
+        )
+)
+"""
+
+# Extend a key's lifetime without ever shortening it: every entry in a warehouse hash
+# carries its own expires_at, the key only has to outlive the longest-lived one.
+_EXTEND_EXPIRE_LUA = """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl >= 0 and ttl >= tonumber(ARGV[1]) then
+    return 0
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+
+def _parse_item_codes(item_codes: Union[str, List[str], None]) -> List[str]:
+    """Normalize item codes given as a list, JSON list, single code or comma-separated string."""
     # Parse item_codes if it's a JSON string, a single code, or a comma-separated list
     if isinstance(item_codes, str):
         try:
@@ -36,15 +77,17 @@ def get_available_qty(
             item_codes = [s.strip() for s in item_codes.split(',') if s and s.strip()]
 
     if not isinstance(item_codes, list) or not item_codes:
-        return {}
+        return []
 
     # Normalize and deduplicate codes
     codes = [str(c).strip() for c in item_codes if c is not None]
     # keep insertion order while deduping
     seen = set()
-    codes = [c for c in codes if c and (c not in seen and not seen.add(c))]
+    return [c for c in codes if c and (c not in seen and not seen.add(c))]
 
-    # Resolve POS Profile first (if not provided, use default profile for current user)
+
+def _resolve_profile(pos_profile: Optional[str] = None):
+    """Return the given POS Profile doc, or the current user's default profile, or None."""
     profile_doc = None
     if pos_profile:
         try:
@@ -56,7 +99,226 @@ def get_available_qty(
             profile_doc = _get_pos_profile(None, None)
         except Exception:
             profile_doc = None
+    return profile_doc
+
+
+def _get_active_bundles(codes: List[str]) -> Dict[str, List[tuple]]:
+    """Map each active Product Bundle among `codes` to its [(component item_code, qty)] rows."""
+    if not codes:
+        return {}
+    filters: Dict[str, Any] = {"new_item_code": ["in", codes]}
+    if frappe.get_meta("Product Bundle").has_field("disabled"):
+        filters["disabled"] = 0
+    names = frappe.get_all("Product Bundle", filters=filters, pluck="name")
+    if not names:
+        return {}
+    bundles: Dict[str, List[tuple]] = {name: [] for name in names}
+    for row in frappe.get_all(
+        "Product Bundle Item",
+        filters={"parenttype": "Product Bundle", "parent": ["in", names]},
+        fields=["parent", "item_code", "qty"],
+        order_by="idx asc",
+    ):
+        bundles[row.parent].append((row.item_code, flt(row.qty)))
+    return bundles
+
+
+def _get_bulk_availability(codes: List[str], warehouses: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Bulk counterpart of ERPNext's get_stock_availability for many items and warehouses.
+
+    Stock items: Bin.actual_qty minus the qty reserved by submitted, not yet consolidated
+    POS Invoices, fetched with one grouped query for bins and one for reservations.
+    Active Product Bundles are delegated to get_stock_availability (component-based qty,
+    reported as stock items). Other non-stock items report 0.
+
+    Returns:
+        dict mapping warehouse -> item_code -> { actual_qty: number, is_stock_item: bool }
+    """
+    result: Dict[str, Dict[str, Dict[str, Any]]] = {wh: {} for wh in warehouses}
+    if not codes or not warehouses:
+        return result
+
+    metas = frappe.get_all("Item", filters={"name": ["in", codes]}, fields=["name", "is_stock_item"])
+    stock_codes = [m.name for m in metas if m.is_stock_item]
+
+    bin_qty: Dict[tuple, float] = {}
+    reserved_qty: Dict[tuple, float] = {}
+    if stock_codes:
+        bins = frappe.get_all(
+            "Bin",
+            filters={"item_code": ["in", stock_codes], "warehouse": ["in", warehouses]},
+            fields=["item_code", "warehouse", "actual_qty"],
+        )
+        for b in bins:
+            bin_qty[(b.warehouse, b.item_code)] = flt(b.actual_qty)
+
+        p_inv = frappe.qb.DocType("POS Invoice")
+        p_item = frappe.qb.DocType("POS Invoice Item")
+        reserved = (
+            frappe.qb.from_(p_inv)
+            .from_(p_item)
+            .select(p_item.item_code, p_item.warehouse, Sum(p_item.stock_qty).as_("stock_qty"))
+            .where(
+                (p_inv.name == p_item.parent)
+                & (IfNull(p_inv.consolidated_invoice, "") == "")
+                & (p_item.docstatus == 1)
+                & (p_item.item_code.isin(stock_codes))
+                & (p_item.warehouse.isin(warehouses))
+            )
+            .groupby(p_item.item_code, p_item.warehouse)
+        ).run(as_dict=True)
+        for r in reserved:
+            reserved_qty[(r.warehouse, r.item_code)] = flt(r.stock_qty)
+
+    stock_set = set(stock_codes)
+    bundle_codes = set(_get_active_bundles([c for c in codes if c not in stock_set]))
+    for wh in warehouses:
+        for code in codes:
+            if code in bundle_codes:
+                try:
+                    qty, _is_stock = get_stock_availability(code, wh)
+                    result[wh][code] = {"actual_qty": flt(qty), "is_stock_item": True}
+                except Exception:
+                    result[wh][code] = {"actual_qty": 0, "is_stock_item": None}
+            elif code in stock_set:
+                key = (wh, code)
+                qty = bin_qty.get(key, 0.0) - reserved_qty.get(key, 0.0)
+                result[wh][code] = {"actual_qty": qty, "is_stock_item": True}
+            else:
+                result[wh][code] = {"actual_qty": 0, "is_stock_item": False}
+    return result
+
+
+def _stock_cache_key(cache, warehouse: str) -> str:
+    return cache.make_key(f"pos_stock_qty:{warehouse}")
+
+
+def _stock_cache_get_many(warehouses: List[str], codes: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Return unexpired cached availability per warehouse for `codes` (misses are omitted)."""
+    hits: Dict[str, Dict[str, Dict[str, Any]]] = {wh: {} for wh in warehouses}
+    try:
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        for wh in warehouses:
+            pipe.hmget(_stock_cache_key(cache, wh), codes)
+        raw_by_wh = pipe.execute()
+    except Exception:
+        return hits
+    now = time.time()
+    for wh, raw in zip(warehouses, raw_by_wh, strict=True):
+        for code, value in zip(codes, raw, strict=True):
+            if not value:
+                continue
+            try:
+                entry = json.loads(value)
+            except Exception:
+                continue
+            if entry.get("expires_at", 0) > now:
+                hits[wh][code] = {"actual_qty": entry.get("actual_qty"), "is_stock_item": entry.get("is_stock_item")}
+    return hits
+
+
+def _stock_cache_set_many(warehouse: str, values: Dict[str, Dict[str, Any]], ttl: int) -> None:
+    if not values:
+        return
+    expires_at = time.time() + ttl
+    mapping = {
+        code: json.dumps({**v, "expires_at": expires_at})
+        for code, v in values.items()
+        if v.get("is_stock_item") is not None
+    }
+    if not mapping:
+        return
+    try:
+        cache = frappe.cache()
+        key = _stock_cache_key(cache, warehouse)
+        pipe = cache.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.eval(_EXTEND_EXPIRE_LUA, 1, key, max(ttl, _get_warmup_ttl()))
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def _get_cached_availability(codes: List[str], warehouses: List[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Availability per warehouse for `codes`, reading all warehouses in one cache round trip
+    and computing every miss with a single bulk availability pass.
+    """
+    result = _stock_cache_get_many(warehouses, codes)
+    miss_whs = [wh for wh in warehouses if len(result[wh]) < len(codes)]
+    if miss_whs:
+        miss_codes = sorted({c for wh in miss_whs for c in codes if c not in result[wh]})
+        try:
+            computed = _get_bulk_availability(miss_codes, miss_whs)
+        except Exception:
+            computed = {wh: {code: {"actual_qty": 0, "is_stock_item": None} for code in miss_codes} for wh in miss_whs}
+        for wh in miss_whs:
+            fresh = {code: v for code, v in computed[wh].items() if code not in result[wh]}
+            _stock_cache_set_many(wh, fresh, STOCK_CACHE_TTL)
+            result[wh].update(fresh)
+    return {wh: {code: result[wh][code] for code in codes} for wh in warehouses}
+
+
+def invalidate_stock_cache(doc, method=None) -> None:
+    """
+    doc_events hook: drop cached availability touched by a stock ledger entry or POS Invoice,
+    including the Product Bundles built from the affected items.
+    """
+    pairs = set()
+    if doc.doctype == "Stock Ledger Entry":
+        pairs.add((doc.warehouse, doc.item_code))
+    else:
+        for row in doc.get("items") or []:
+            wh = row.get("warehouse") or doc.get("set_warehouse")
+            if wh and row.get("item_code"):
+                pairs.add((wh, row.get("item_code")))
+    if not pairs:
+        return
+    try:
+        parents = frappe.get_all(
+            "Product Bundle Item",
+            filters={"parenttype": "Product Bundle", "item_code": ["in", sorted({code for _wh, code in pairs})]},
+            fields=["parent", "item_code"],
+        )
+        for row in parents:
+            pairs.update((wh, row.parent) for wh, code in list(pairs) if code == row.item_code)
+    except Exception:
+        pass
+    try:
+        cache = frappe.cache()
+        pipe = cache.pipeline()
+        for wh, code in pairs:
+            pipe.hdel(_stock_cache_key(cache, wh), code)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+@frappe.whitelist()
+def get_available_qty(
+    item_codes: Union[str, List[str], None] = None,
+    pos_profile: Optional[str] = None,
+    warehouse: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Batch API to fetch available stock quantity for multiple items for POS.
 
+    Args:
+        item_codes: List of Item Codes, or a JSON-encoded list of Item Codes. Optional; empty or missing returns {}.
+        pos_profile: POS Profile to derive context (optional; auto-resolved for current user if omitted).
+        warehouse: Ignored. Always resolved from the POS Profile (see get_multi_warehouse_qty for other warehouses).
+
+    Returns:
+        dict mapping item_code -> { actual_qty: number, is_stock_item: bool }
+    """
+    codes = _parse_item_codes(item_codes)
+    if not codes:
+        return {}
+
+    # Resolve POS Profile first (if not provided, use default profile for current user)
+    profile_doc = _resolve_profile(pos_profile)
     if not profile_doc:
         return {}
 
@@ -64,45 +326,527 @@ def get_available_qty(
     if not wh:
         return {}
 
-    # Bulk fetch item metadata to avoid unnecessary heavy calls
+    # Per-item cache (see STOCK_CACHE_TTL); warm-up fills the same entries ahead of time
+    return _get_cached_availability(codes, [wh])[wh]
+
+
+def _permitted_warehouses(warehouses: List[str], profile_doc) -> List[str]:
+    """
+    Keep the enabled leaf warehouses of the profile's company that the session user may
+    read (role and User Permissions, via get_list), preserving order. The profile's own
+    warehouse is always allowed.
+    """
+    if not warehouses:
+        return []
+    filters: Dict[str, Any] = {"name": ["in", warehouses], "is_group": 0, "disabled": 0}
+    company = profile_doc.get("company") if profile_doc else None
+    if company:
+        filters["company"] = company
+    try:
+        allowed = set(frappe.get_list("Warehouse", filters=filters, pluck="name"))
+    except frappe.PermissionError:
+        allowed = set()
+    default_wh = profile_doc.warehouse if profile_doc else None
+    if default_wh:
+        allowed.add(default_wh)
+    return [wh for wh in warehouses if wh in allowed]
+
+
+def _resolve_availability_warehouses(
+    profile_doc,
+    warehouses: Union[str, List[str], None] = None,
+    warehouse_group: Optional[str] = None,
+) -> List[str]:
+    """
+    Warehouses to report, in priority order:
+      - an explicit list,
+      - the leaf warehouses under `warehouse_group`,
+      - the profile's `custom_availability_warehouse_group` (if that custom field exists),
+      - the leaf warehouses sharing the profile warehouse's parent group.
+    The profile warehouse is always included and listed first; everything else is limited
+    to _permitted_warehouses and the result is capped at MAX_AVAILABILITY_WAREHOUSES.
+    """
+    default_wh = profile_doc.warehouse if profile_doc else None
+    candidates = _parse_item_codes(warehouses)
+
+    if not candidates:
+        group = warehouse_group
+        if not group and profile_doc:
+            group = profile_doc.get("custom_availability_warehouse_group")
+        if not group and default_wh:
+            group = frappe.db.get_value("Warehouse", default_wh, "parent_warehouse")
+        if group:
+            bounds = frappe.db.get_value("Warehouse", group, ["lft", "rgt"], as_dict=True)
+            if bounds:
+                candidates = frappe.get_all(
+                    "Warehouse",
+                    filters={"lft": [">=", bounds.lft], "rgt": ["<=", bounds.rgt], "is_group": 0, "disabled": 0},
+                    pluck="name",
+                    order_by="name asc",
+                )
+
+    if default_wh:
+        candidates = [default_wh] + [wh for wh in candidates if wh != default_wh]
+    if not candidates:
+        return []
+
+    return _permitted_warehouses(candidates, profile_doc)[:MAX_AVAILABILITY_WAREHOUSES]
+
+
+@frappe.whitelist()
+def get_multi_warehouse_qty(
+    item_codes: Union[str, List[str], None] = None,
+    warehouses: Union[str, List[str], None] = None,
+    warehouse_group: Optional[str] = None,
+    pos_profile: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Batch API to fetch available stock for multiple items across several warehouses at once.
+
+    Args:
+        item_codes: List of Item Codes, or a JSON-encoded list / comma-separated string.
+        warehouses: Explicit warehouses to report (list, JSON list or comma-separated);
+            limited to the profile's company and the user's Warehouse permissions.
+        warehouse_group: Group warehouse whose leaf warehouses should be reported (same limits).
+        pos_profile: POS Profile to derive context (optional; auto-resolved for current user if omitted).
+
+    Returns:
+        {
+            warehouses: [{ warehouse, warehouse_name, is_default }],
+            items: { item_code: { is_stock_item, total_qty, by_warehouse: { warehouse: qty } } }
+        }
+    """
+    empty: Dict[str, Any] = {"warehouses": [], "items": {}}
+    codes = _parse_item_codes(item_codes)
+    if not codes:
+        return empty
+
+    profile_doc = _resolve_profile(pos_profile)
+    whs = _resolve_availability_warehouses(profile_doc, warehouses, warehouse_group)
+    if not whs:
+        return empty
+
+    default_wh = profile_doc.warehouse if profile_doc else None
+    names = {
+        w.name: w.warehouse_name
+        for w in frappe.get_all("Warehouse", filters={"name": ["in", whs]}, fields=["name", "warehouse_name"])
+    }
+    availability = _get_cached_availability(codes, whs)
+
+    items: Dict[str, Dict[str, Any]] = {}
+    for code in codes:
+        by_wh = {wh: availability[wh][code].get("actual_qty") or 0 for wh in whs}
+        is_stock = next(
+            (availability[wh][code].get("is_stock_item") for wh in whs if availability[wh][code].get("is_stock_item") is not None),
+            None,
+        )
+        items[code] = {
+            "is_stock_item": is_stock,
+            "total_qty": sum(q for q in by_wh.values() if q > 0),
+            "by_warehouse": by_wh,
+        }
+
+    return {
+        "warehouses": [
+            {"warehouse": wh, "warehouse_name": names.get(wh) or wh, "is_default": wh == default_wh}
+            for wh in whs
+        ],
+        "items": items,
+    }
+
+
+@frappe.whitelist()
+def get_available_serials(
+    item_codes: Union[str, List[str], None] = None,
+    warehouse: Optional[str] = None,
+    limit: Union[int, str, None] = None,
+    exclude: Union[str, List[str], None] = None,
+    pos_profile: Optional[str] = None,
+) -> Dict[str, List[str]]:
+    """
+    Batch API returning the first N free serial numbers per item from a single indexed query.
+
+    Serials held by submitted, not yet consolidated POS Invoices are not free and are skipped.
+
+    Args:
+        item_codes: List of Item Codes, or a JSON-encoded list / comma-separated string.
+        warehouse: Warehouse to pick from (optional; defaults to the POS Profile warehouse;
+            other warehouses must pass _permitted_warehouses).
+        limit: Max serials per item (default 20, capped at 200).
+        exclude: Serials already used by the client (e.g. in the cart), same formats as item_codes.
+        pos_profile: POS Profile used to resolve the warehouse when none is given.
+
+    Returns:
+        dict mapping item_code -> [serial_no, ...] (oldest first); items without serials are omitted.
+    """
+    codes = _parse_item_codes(item_codes)
+    if not codes:
+        return {}
+
+    profile_doc = _resolve_profile(pos_profile)
+    if warehouse:
+        warehouse = next(iter(_permitted_warehouses([warehouse], profile_doc)), None)
+    elif profile_doc:
+        warehouse = profile_doc.warehouse
+    if not warehouse:
+        return {}
+
+    n = min(max(cint(limit) or DEFAULT_SERIAL_LIMIT, 1), MAX_SERIAL_LIMIT)
+    excluded = _parse_item_codes(exclude)
+
+    # ROW_NUMBER keeps this a single query regardless of how many items are requested;
+    # POS-reserved serials are excluded in the same query
+    rows = frappe.db.sql(
+        f"""
+        select item_code, name
+        from (
+            select sn.item_code, sn.name,
+                row_number() over (partition by sn.item_code order by sn.creation, sn.name) as rn
+            from `tabSerial No` sn
+            where sn.item_code in %(codes)s
+                and sn.warehouse = %(warehouse)s
+                and sn.status = 'Active'
+                and not ({_POS_SERIAL_HELD_SQL.format(is_return=0)} and not {_POS_SERIAL_HELD_SQL.format(is_return=1)})
+                {"and sn.name not in %(exclude)s" if excluded else ""}
+        ) ranked
+        where rn <= %(limit)s
+        order by item_code, rn
+        """,
+        {"codes": codes, "warehouse": warehouse, "limit": n, "exclude": excluded},
+        as_dict=True,
+    )
+
+    result: Dict[str, List[str]] = {}
+    for r in rows:
+        result.setdefault(r.item_code, []).append(r.name)
+    return result
+
+
+def _sale_item_rows(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    items = doc.get("items") or []
+    return [it for it in items if isinstance(it, dict)] if isinstance(items, list) else []
+
+
+def _sale_item_code(row: Dict[str, Any]) -> Optional[str]:
+    code = row.get("item_code") or row.get("code") or row.get("item")
+    return str(code) if code else None
+
+
+def _sale_stock_lines(
+    doc: Dict[str, Any],
+    default_warehouse: Optional[str],
+    bundles: Optional[Dict[str, List[tuple]]] = None,
+    allowed_warehouses: Optional[set] = None,
+) -> Dict[tuple, float]:
+    """
+    Aggregate a sale's item rows into stock qty per (warehouse, item_code).
+
+    Rows for Product Bundles in `bundles` are expanded into their components. When
+    `allowed_warehouses` is given, rows naming any other warehouse count against
+    `default_warehouse` instead.
+    """
+    lines: Dict[tuple, float] = {}
+    bundles = bundles or {}
+    for it in _sale_item_rows(doc):
+        if not isinstance(it, dict):
+            continue
+        code = _sale_item_code(it)
+        wh = it.get("warehouse") or doc.get("set_warehouse") or default_warehouse
+        if allowed_warehouses is not None and wh not in allowed_warehouses:
+            wh = default_warehouse
+        if not code or not wh:
+            continue
+        qty = it.get("stock_qty")
+        if qty is None:
+            qty = flt(it.get("qty")) * (flt(it.get("conversion_factor")) or 1)
+        for component, per_unit in bundles.get(code) or [(code, 1.0)]:
+            lines[(wh, component)] = lines.get((wh, component), 0.0) + flt(qty) * per_unit
+    return lines
+
+
+def classify_sales(
+    sales: List[Dict[str, Any]],
+    default_warehouse: Optional[str] = None,
+    allowed_warehouses: Optional[set] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Classify a replay batch against current stock before any invoice is inserted.
+
+    Demand is aggregated per (warehouse, item) across the whole batch and compared with
+    availability fetched in one pass; Product Bundles count against their components.
+    Sales consume stock in batch order:
+      - "conflict": the running demand including this sale exceeds what is available
+        (conflicting sales are held for review, so they do not consume stock)
+      - "at_risk": this sale fits, but the batch as a whole oversells one of its items
+      - "safe": every stock line fits even if the whole batch is submitted
+
+    Args:
+        sales: list of { sale_id, doc } entries (doc is a POS/Sales Invoice payload)
+        default_warehouse: warehouse used for rows that don't carry their own
+        allowed_warehouses: optional set of warehouses rows may name (others fall back
+            to default_warehouse)
+
+    Returns:
+        list of { sale_id, status, lines } in input order; lines only list short items.
+    """
+    sale_codes = {code for s in sales for code in map(_sale_item_code, _sale_item_rows(s.get("doc") or {})) if code}
+    bundles = _get_active_bundles(sorted(sale_codes))
+    per_sale = [
+        _sale_stock_lines(s.get("doc") or {}, default_warehouse, bundles, allowed_warehouses) for s in sales
+    ]
+
+    total_demand: Dict[tuple, float] = {}
+    for lines in per_sale:
+        for key, qty in lines.items():
+            total_demand[key] = total_demand.get(key, 0.0) + qty
+
+    warehouses = sorted({wh for wh, _code in total_demand})
+    codes = sorted({code for _wh, code in total_demand})
+    availability = _get_bulk_availability(codes, warehouses)
+
     try:
-        metas = frappe.get_all('Item', filters={'name': ['in', codes]}, fields=['name', 'is_stock_item'])
-        meta_map = {m.name: bool(m.is_stock_item) for m in metas}
+        allow_negative = bool(frappe.db.get_single_value("Stock Settings", "allow_negative_stock"))
     except Exception:
-        meta_map = {}
+        allow_negative = False
+
+    running: Dict[tuple, float] = {}
+    out: List[Dict[str, Any]] = []
+    for sale, lines in zip(sales, per_sale, strict=True):
+        status = "safe"
+        short = []
+        for key, qty in lines.items():
+            wh, code = key
+            info = availability.get(wh, {}).get(code) or {}
+            if allow_negative or not info.get("is_stock_item"):
+                continue
+            available = flt(info.get("actual_qty"))
+            if running.get(key, 0.0) + qty > available + 1e-9:
+                line_status = "conflict"
+            elif total_demand[key] > available + 1e-9:
+                line_status = "at_risk"
+            else:
+                continue
+            if line_status == "conflict" or status == "safe":
+                status = line_status
+            short.append({
+                "item_code": code,
+                "warehouse": wh,
+                "qty": qty,
+                "available": available,
+                "batch_demand": total_demand[key],
+            })
+        if status != "conflict":
+            for key, qty in lines.items():
+                running[key] = running.get(key, 0.0) + qty
+        out.append({"sale_id": sale.get("sale_id"), "status": status, "lines": short})
+    return out
+
 
-    # Short TTL cache to reduce repeated load (e.g., POS polling). Cache per-warehouse + codes hash.
+def _submitted_offline_ids(offline_ids: List[str]) -> set:
+    """Offline sale ids that already map to a submitted POS Invoice (via custom_pos_offline_id)."""
+    if not offline_ids or not frappe.get_meta("POS Invoice").has_field("custom_pos_offline_id"):
+        return set()
+    return set(
+        frappe.get_all(
+            "POS Invoice",
+            filters={"custom_pos_offline_id": ["in", offline_ids], "docstatus": 1},
+            pluck="custom_pos_offline_id",
+        )
+    )
+
+
+@frappe.whitelist(methods=["POST"])  # type: ignore[misc]
+def precheck_sales(
+    sales: Union[str, List[Any], None] = None,
+    pos_profile: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Stock-conflict pre-check for an offline replay batch.
+
+    Args:
+        sales: List (or JSON list) of sale payloads, either bare invoice docs or
+            { sale_id, offline_id, doc } entries. offline_id (default: the doc's
+            __sale_id / __pos_sale_id) identifies the sale on the server.
+        pos_profile: POS Profile whose warehouse applies to rows without one, and to rows
+            naming a warehouse that fails _permitted_warehouses
+            (optional; auto-resolved for current user if omitted).
+
+    Returns:
+        dict { sales: [{ sale_id, status, lines }], summary: { safe, at_risk, conflict },
+               already_submitted: [sale_id] }
+        Sales whose invoice was already submitted (e.g. the submit committed but the client
+        saw an error) are listed in already_submitted and left out of demand and verdicts:
+        availability already subtracts their reservation.
+    """
     try:
-        cache = frappe.cache()
+        user = frappe.session.user
     except Exception:
-        cache = None
+        user = None
+    if not user or user == 'Guest':
+        frappe.throw(_("Authentication required"), frappe.PermissionError)
 
-    # create a small deterministic cache key based on warehouse and codes
-    codes_blob = ','.join(codes)
-    key_hash = hashlib.sha1(codes_blob.encode('utf-8')).hexdigest()[:12]
-    cache_key = f"pos_stock:{wh}:{key_hash}"
-    TTL_SECONDS = 5  # short TTL to keep near-real-time correctness while reducing load
+    if isinstance(sales, str):
+        try:
+            sales = json.loads(sales)
+        except Exception:
+            frappe.throw(_("Invalid sales payload"))
+    if not isinstance(sales, list):
+        frappe.throw(_("Sales must be a list"))
+    if len(sales) > MAX_PRECHECK_SALES:
+        frappe.throw(_("Too many sales in precheck payload"))
 
-    def compute():
-        result: Dict[str, Dict[str, Any]] = {}
-        for code in codes:
+    entries = []
+    for i, s in enumerate(sales):
+        if not isinstance(s, dict):
+            frappe.throw(_("Invalid sale entry in payload"))
+        doc = s.get("doc") if isinstance(s.get("doc"), dict) else s
+        offline_id = s.get("offline_id") or doc.get("__sale_id") or doc.get("__pos_sale_id")
+        sale_id = s.get("sale_id") or offline_id or str(i)
+        entries.append({"sale_id": sale_id, "offline_id": offline_id, "doc": doc})
+
+    submitted = _submitted_offline_ids(sorted({str(e["offline_id"]) for e in entries if e["offline_id"]}))
+    already_submitted = [e["sale_id"] for e in entries if e["offline_id"] and str(e["offline_id"]) in submitted]
+    entries = [e for e in entries if not (e["offline_id"] and str(e["offline_id"]) in submitted)]
+
+    profile_doc = _resolve_profile(pos_profile)
+    default_wh = profile_doc.warehouse if profile_doc else None
+
+    # only report stock for warehouses the user may read
+    named = sorted({
+        wh
+        for e in entries
+        for wh in [e["doc"].get("set_warehouse")] + [it.get("warehouse") for it in _sale_item_rows(e["doc"])]
+        if wh and isinstance(wh, str)
+    })
+    allowed = set(_permitted_warehouses(named, profile_doc))
+    if default_wh:
+        allowed.add(default_wh)
+
+    results = classify_sales(entries, default_wh, allowed)
+    summary = {"safe": 0, "at_risk": 0, "conflict": 0}
+    for r in results:
+        summary[r["status"]] += 1
+    return {"sales": results, "summary": summary, "already_submitted": already_submitted}
+
+
+def _get_warmup_ttl() -> int:
+    return cint(frappe.conf.get("pos_mobile_stock_warmup_ttl")) or DEFAULT_WARMUP_TTL
+
+
+def _get_sellable_items(item_groups: Optional[List[str]], limit: int) -> List[str]:
+    """Enabled sales items (no templates), optionally restricted to item groups and their descendants."""
+    filters: Dict[str, Any] = {"disabled": 0, "is_sales_item": 1, "has_variants": 0}
+    if item_groups:
+        from frappe.utils.nestedset import get_descendants_of
+
+        groups = set(item_groups)
+        for g in item_groups:
             try:
-                is_stock = meta_map.get(code, False)
-                if is_stock:
-                    qty, is_stock_item = get_stock_availability(code, wh)
-                    result[code] = {"actual_qty": qty, "is_stock_item": True}
-                else:
-                    result[code] = {"actual_qty": 0, "is_stock_item": False}
+                groups.update(get_descendants_of("Item Group", g))
             except Exception:
-                result[code] = {"actual_qty": 0, "is_stock_item": None}
-        return result
+                pass
+        filters["item_group"] = ["in", sorted(groups)]
+    return frappe.get_all("Item", filters=filters, pluck="name", order_by="name asc", limit_page_length=limit)
 
-    if cache:
-        try:
-            # get_value will call compute() if key missing and set it with expiry
-            return cache.get_value(cache_key, compute, expires=TTL_SECONDS)
-        except Exception:
-            # on cache failure, compute directly
-            return compute()
 
-    return compute()
+def warm_stock_cache(warehouses: Optional[List[str]] = None, ttl: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Precompute availability for every active POS Profile warehouse and load it into the stock cache.
+
+    Each warehouse is warmed once with the union of the sellable item sets of the profiles that
+    use it (a profile without item groups sells everything). The item set is capped by
+    `pos_mobile_stock_warmup_limit` and entries live `pos_mobile_stock_warmup_ttl` seconds
+    unless `ttl` is given.
+
+    Args:
+        warehouses: Optional subset of warehouses to warm (e.g. after a bulk Stock Entry).
+        ttl: Entry lifetime in seconds (the scheduled run stretches it past opening time).
+
+    Returns:
+        timing stats { started_at, seconds, warehouses: [{ warehouse, items, seconds }] }
+    """
+    started = time.monotonic()
+    limit = cint(frappe.conf.get("pos_mobile_stock_warmup_limit")) or DEFAULT_WARMUP_ITEM_LIMIT
+    ttl = cint(ttl) or _get_warmup_ttl()
+
+    profiles = frappe.get_all("POS Profile", filters={"disabled": 0}, fields=["name", "warehouse"])
+    if warehouses:
+        profiles = [p for p in profiles if p.warehouse in set(warehouses)]
+
+    groups_by_profile: Dict[str, List[str]] = {}
+    if profiles:
+        for row in frappe.get_all(
+            "POS Item Group",
+            filters={"parenttype": "POS Profile", "parent": ["in", [p.name for p in profiles]]},
+            fields=["parent", "item_group"],
+        ):
+            groups_by_profile.setdefault(row.parent, []).append(row.item_group)
+
+    # warehouse -> item groups (None = all sellable items)
+    groups_by_wh: Dict[str, Optional[set]] = {}
+    for p in profiles:
+        if not p.warehouse:
+            continue
+        groups = groups_by_profile.get(p.name)
+        if p.warehouse in groups_by_wh and groups_by_wh[p.warehouse] is None:
+            continue
+        if not groups:
+            groups_by_wh[p.warehouse] = None
+        else:
+            groups_by_wh.setdefault(p.warehouse, set()).update(groups)
+
+    stats: Dict[str, Any] = {"started_at": str(now_datetime()), "limit": limit, "ttl": ttl, "warehouses": []}
+    for wh, groups in groups_by_wh.items():
+        wh_started = time.monotonic()
+        codes = _get_sellable_items(sorted(groups) if groups else None, limit)
+        for i in range(0, len(codes), WARMUP_CHUNK_SIZE):
+            chunk = codes[i : i + WARMUP_CHUNK_SIZE]
+            _stock_cache_set_many(wh, _get_bulk_availability(chunk, [wh])[wh], ttl)
+        stats["warehouses"].append(
+            {"warehouse": wh, "items": len(codes), "seconds": round(time.monotonic() - wh_started, 3)}
+        )
+    stats["seconds"] = round(time.monotonic() - started, 3)
+
+    try:
+        frappe.cache().set_value("pos_stock_warmup:last", stats)
+    except Exception:
+        pass
+    frappe.logger("pos_mobile").info(f"POS stock warm-up: {stats}")
+    return stats
+
+
+def scheduled_stock_warmup() -> None:
+    """
+    Hourly scheduler entry; warms during the hour before each store opening hour
+    (`pos_mobile_stock_warmup_hours`). Entries live until opening plus the normal warm-up
+    TTL, so they are still there when the first sales come in; stock movements in between
+    drop them through invalidate_stock_cache.
+    """
+    hours = frappe.conf.get("pos_mobile_stock_warmup_hours") or DEFAULT_WARMUP_HOURS
+    now = now_datetime()
+    if (now.hour + 1) % 24 not in {cint(h) % 24 for h in hours}:
+        return
+    opening = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    warm_stock_cache(ttl=int((opening - now).total_seconds()) + _get_warmup_ttl())
+
+
+def enqueue_stock_warmup(doc, method=None) -> None:
+    """doc_events hook: re-warm the warehouses touched by a bulk Stock Entry once it commits."""
+    threshold = cint(frappe.conf.get("pos_mobile_stock_warmup_bulk_rows")) or DEFAULT_WARMUP_BULK_ROWS
+    rows = doc.get("items") or []
+    if len(rows) < threshold:
+        return
+    warehouses = sorted({wh for r in rows for wh in (r.get("s_warehouse"), r.get("t_warehouse")) if wh})
+    if not warehouses:
+        return
+    try:
+        frappe.enqueue(
+            "pos_mobile.pos_mobile.api.pos_stock.warm_stock_cache",
+            queue="long",
+            warehouses=warehouses,
+            enqueue_after_commit=True,
+            job_id=f"pos_stock_warmup:{','.join(warehouses)}",
+            deduplicate=True,
+        )
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "POS stock warm-up enqueue failed")
@@ -1,23 +1,40 @@
 import json
-from typing import Any, Dict, Union, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import frappe
 from frappe import _
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import get_bank_cash_account
 import re
 
+from pos_mobile.pos_mobile.api.pos_admission import (
+    PRIORITY_BACKLOG,
+    admit,
+    max_admissible_cost,
+    throttled_response,
+)
+
+# Upper bound on entries accepted by a single mark_paid_batch call
+MAX_BATCH_SALES = 50
+
 
 @frappe.whitelist(methods=["POST"])  # type: ignore[misc]
-def submit_sale(sale: Union[str, Dict[str, Any]], sale_id: Optional[str] = None) -> Dict[str, Any]:
+def submit_sale(
+    sale: Union[str, Dict[str, Any]],
+    sale_id: Optional[str] = None,
+    priority: Optional[str] = None,
+    terminal_id: Optional[str] = None,
+) -> Dict[str, Any]:
     """
     Accept offline POS sale payload and create a POS Invoice idempotently.
 
     Args:
         sale: JSON string or dict of a POS Invoice document (POS payload).
         sale_id: Optional client-side unique id (e.g., "sale:{uuid}") for idempotency.
+        priority: "live" (default) or "backlog" for offline replays; backlog yields to live sales.
+        terminal_id: Optional client terminal id used for per-terminal rate limiting.
 
     Returns:
-        dict with keys { ok, name, message }
+        dict with keys { ok, name, message }; when throttled also { throttled, retry_after }
     """
     # Require authenticated session to reduce abuse (disallow Guest)
     try:
@@ -44,6 +61,11 @@ def submit_sale(sale: Union[str, Dict[str, Any]], sale_id: Optional[str] = None)
     if not isinstance(doc, dict):
         frappe.throw(_("Sale payload must be a POS Invoice doc"))
 
+    # Admission control before any expensive validation/insert work
+    allowed, retry_after = admit(doc.get("pos_profile"), terminal_id, priority)
+    if not allowed:
+        return throttled_response(retry_after)
+
     # Basic payload size limits to prevent large/abusive submissions
     MAX_ITEMS = 200
     items = doc.get('items') or []
@@ -229,18 +251,10 @@ def submit_sale(sale: Union[str, Dict[str, Any]], sale_id: Optional[str] = None)
     return {"ok": True, "name": si.name, "message": _("created")}
 
 
-@frappe.whitelist(methods=["POST"])  # type: ignore[misc]
-def mark_paid(name: Optional[str] = None, sale_id: Optional[str] = None, doctype: Optional[str] = None) -> Dict[str, Any]:
-    """
-    Mark an existing POS/Sales Invoice as Paid without creating a new invoice.
-
-    It attempts to locate an existing invoice using, in priority order:
-      - Explicit name (and optional doctype)
-      - sale_id matched against custom_pos_offline_id or present in remarks
-
-    If the invoice is found and is a draft, it will be submitted as fully paid.
-    If already submitted, it returns as already processed.
-    """
+def _find_invoice(
+    name: Optional[str] = None, sale_id: Optional[str] = None, doctype: Optional[str] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """Locate an invoice by explicit name or offline sale_id markers. Returns (doctype, name) or (None, None)."""
     dt_candidates = []
     if doctype:
         if doctype in ("POS Invoice", "Sales Invoice"):
@@ -284,12 +298,11 @@ def mark_paid(name: Optional[str] = None, sale_id: Optional[str] = None, doctype
                 target_dt, target_name = dt, found
                 break
 
-    if not target_name:
-        return {"ok": False, "message": _("Invoice not found")}
+    return target_dt, target_name
 
-    if not frappe.has_permission(target_dt, "submit"):
-        frappe.throw(_(f"Not permitted to submit {target_dt}"), frappe.PermissionError)
 
+def _settle_invoice(target_dt: str, target_name: str) -> Dict[str, Any]:
+    """Submit a located draft invoice as fully paid; idempotent for already-submitted invoices."""
     si = frappe.get_doc(target_dt, target_name)
 
     # if already submitted and paid, treat as idempotent success
@@ -352,3 +365,143 @@ def mark_paid(name: Optional[str] = None, sale_id: Optional[str] = None, doctype
     return {"ok": True, "name": si.name, "message": _("already submitted")}
 
 
+@frappe.whitelist(methods=["POST"])  # type: ignore[misc]
+def mark_paid(
+    name: Optional[str] = None,
+    sale_id: Optional[str] = None,
+    doctype: Optional[str] = None,
+    priority: Optional[str] = None,
+    terminal_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Mark an existing POS/Sales Invoice as Paid without creating a new invoice.
+
+    It attempts to locate an existing invoice using, in priority order:
+      - Explicit name (and optional doctype)
+      - sale_id matched against custom_pos_offline_id or present in remarks
+
+    If the invoice is found and is a draft, it will be submitted as fully paid.
+    If already submitted, it returns as already processed.
+
+    `priority` and `terminal_id` feed admission control (see pos_admission); when the
+    caller is throttled the response carries { ok: False, throttled: True, retry_after }.
+    """
+    # Terminal bucket before the (remarks-scanning) invoice lookup; the profile is only known after it
+    allowed, retry_after = admit(None, terminal_id, priority)
+    if not allowed:
+        return throttled_response(retry_after)
+
+    target_dt, target_name = _find_invoice(name, sale_id, doctype)
+    if not target_name:
+        return {"ok": False, "message": _("Invoice not found"), "retryable": True}
+
+    if not frappe.has_permission(target_dt, "submit"):
+        frappe.throw(_(f"Not permitted to submit {target_dt}"), frappe.PermissionError)
+
+    try:
+        profile_name = frappe.db.get_value(target_dt, target_name, "pos_profile")
+    except Exception:
+        profile_name = None
+    allowed, retry_after = admit(profile_name, terminal_id, priority, charge_terminal=False)
+    if not allowed:
+        return throttled_response(retry_after)
+
+    return _settle_invoice(target_dt, target_name)
+
+
+@frappe.whitelist(methods=["POST"])  # type: ignore[misc]
+def mark_paid_batch(
+    sales: Union[str, List[Dict[str, Any]], None] = None,
+    priority: Optional[str] = None,
+    terminal_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Batch variant of mark_paid for client sync workers.
+
+    Each entry is located and settled inside its own savepoint, so one bad sale
+    does not fail (or roll back) the others. The whole batch is admitted at once
+    with a cost equal to its size, before any invoice lookup; batches larger than a
+    full bucket can admit (see get_sync_capabilities' max_batch) are rejected.
+
+    Args:
+        sales: List (or JSON list) of { name, sale_id, doctype } entries.
+        priority / terminal_id: as for mark_paid.
+
+    Returns:
+        { ok: True, results: [{ sale_id, ok, name, message, retryable }] } in input order,
+        or the throttled payload { ok: False, throttled: True, retry_after } for the whole batch.
+    """
+    if isinstance(sales, str):
+        try:
+            sales = json.loads(sales)
+        except Exception:
+            frappe.throw(_("Invalid sales payload"))
+    if not isinstance(sales, list):
+        frappe.throw(_("Sales must be a list"))
+    if len(sales) > min(MAX_BATCH_SALES, max_admissible_cost(priority)):
+        frappe.throw(_("Too many sales in batch"))
+    if not all(isinstance(entry, dict) for entry in sales):
+        frappe.throw(_("Invalid sale entry in payload"))
+
+    # Terminal bucket first so throttled callers skip the (remarks-scanning) invoice lookups
+    allowed, retry_after = admit(None, terminal_id, priority, cost=len(sales))
+    if not allowed:
+        return throttled_response(retry_after)
+
+    located = []
+    for entry in sales:
+        target_dt, target_name = _find_invoice(entry.get("name"), entry.get("sale_id"), entry.get("doctype"))
+        located.append((entry, target_dt, target_name))
+
+    profile_name = None
+    for _entry, target_dt, target_name in located:
+        if target_name:
+            try:
+                profile_name = frappe.db.get_value(target_dt, target_name, "pos_profile")
+            except Exception:
+                profile_name = None
+            break
+    allowed, retry_after = admit(profile_name, terminal_id, priority, cost=len(sales), charge_terminal=False)
+    if not allowed:
+        return throttled_response(retry_after)
+
+    results = []
+    for i, (entry, target_dt, target_name) in enumerate(located):
+        sale_id = entry.get("sale_id")
+        if not target_name:
+            # same policy as mark_paid: the invoice may still be in flight, retry with backoff
+            results.append({"sale_id": sale_id, "ok": False, "message": _("Invoice not found"), "retryable": True})
+            continue
+        if not frappe.has_permission(target_dt, "submit"):
+            results.append({
+                "sale_id": sale_id,
+                "ok": False,
+                "message": _("Not permitted to submit {0}").format(target_dt),
+                "retryable": False,
+            })
+            continue
+        save_point = f"pos_mark_paid_{i}"
+        frappe.db.savepoint(save_point)
+        try:
+            res = _settle_invoice(target_dt, target_name)
+        except frappe.ValidationError as e:
+            frappe.db.rollback(save_point=save_point)
+            res = {"ok": False, "message": str(e) or _("Validation failed"), "retryable": False}
+        except Exception:
+            frappe.db.rollback(save_point=save_point)
+            res = {"ok": False, "message": _("Could not mark invoice as paid"), "retryable": True}
+        res["sale_id"] = sale_id
+        results.append(res)
+
+    return {"ok": True, "results": results}
+
+
+@frappe.whitelist()
+def get_sync_capabilities() -> Dict[str, Any]:
+    """Advertise optional sync endpoints so clients can switch to batch mode when available."""
+    return {
+        "batch_method": "pos_mobile.pos_mobile.api.pos_sync.mark_paid_batch",
+        # backlog batches larger than this could never pass admission control
+        "max_batch": min(MAX_BATCH_SALES, max_admissible_cost(PRIORITY_BACKLOG)),
+        "precheck_method": "pos_mobile.pos_mobile.api.pos_stock.precheck_sales",
+    }
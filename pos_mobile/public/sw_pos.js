@@ -1,11 +1,82 @@
-const CACHE_VERSION = 'pos-mobile-v1';
+const CACHE_VERSION = 'pos-mobile-v2';
 const ASSET_CACHE = `assets-${CACHE_VERSION}`;
+const API_CACHE = `api-${CACHE_VERSION}`;
+const PRECACHE = `precache-${CACHE_VERSION}`;
+const META_CACHE = `meta-${CACHE_VERSION}`;
 
 // Core assets to seed the cache. Keep minimal to avoid install failures.
 const CORE_ASSETS = ['/', /* additional app shell routes may be added here */ ];
 
+// Build manifest written by `bench build`: maps bundle names to content-hashed URLs,
+// so the hashed URLs double as the precache version.
+const PRECACHE_MANIFEST_URL = '/assets/assets.json';
+// Bundles that make up the POS page (desk shell + ERPNext point-of-sale bundle)
+const PRECACHE_BUNDLES = [
+  'libs.bundle.js',
+  'desk.bundle.js',
+  'desk.bundle.css',
+  'controls.bundle.js',
+  'dialog.bundle.js',
+  'erpnext.bundle.js',
+  'erpnext.bundle.css',
+  'point-of-sale.bundle.js',
+  'point-of-sale.bundle.css'
+];
+// Synthetic key under which the last applied manifest digest is stored
+const PRECACHE_STAMP = '/__pos_mobile_precache_manifest__';
+// Re-check the build manifest at most this often (a new build does not change this file)
+const PRECACHE_REFRESH_MS = 60 * 60 * 1000;
+
 // Maximum number of entries to keep in the asset cache (prevents uncontrolled growth)
 const MAX_ASSET_ENTRIES = 200;
+const MAX_API_ENTRIES = 200;
+
+// Safe GET endpoints served from the API cache:
+// - 'swr' (stale-while-revalidate): younger than ttl is served from cache, younger than
+//   maxAge is served from cache and refreshed in the background, older (or missing) goes
+//   to the network, falling back to the stale copy when offline
+// - 'network-first': network with a timeout, falling back to a copy younger than maxAge.
+//   Used for stock, which the page polls less often than any useful ttl, so SWR would
+//   always hand back the previous poll's answer.
+const API_ROUTES = [
+  { method: 'pos_mobile.pos_mobile.api.pos_stock.get_available_qty', strategy: 'network-first', timeoutMs: 3000, maxAge: 10 * 60 * 1000 },
+  { method: 'pos_mobile.pos_mobile.api.pos_stock.get_multi_warehouse_qty', strategy: 'network-first', timeoutMs: 3000, maxAge: 10 * 60 * 1000 },
+  { method: 'pos_mobile.pos_mobile.api.pos_sync.get_sync_capabilities', strategy: 'swr', ttl: 60 * 60 * 1000, maxAge: 7 * 24 * 60 * 60 * 1000 }
+];
+const CACHED_AT_HEADER = 'x-pos-sw-cached-at';
+
+// API responses are filtered by the session user's permissions and the cache is keyed by URL
+// only, so it belongs to one user: the POS page reports its user, the cache is wiped when it
+// changes (shared tablets) and API caching is skipped while the user is unknown or Guest.
+const SESSION_USER_KEY = '/__pos_mobile_session_user__';
+let sessionUserValue = null;
+
+async function sessionUser() {
+  if (sessionUserValue !== null) return sessionUserValue;
+  try {
+    const stored = await (await caches.open(META_CACHE)).match(SESSION_USER_KEY);
+    sessionUserValue = stored ? await stored.text() : '';
+  } catch (e) {
+    sessionUserValue = '';
+  }
+  return sessionUserValue;
+}
+
+async function setSessionUser(user) {
+  const next = user && user !== 'Guest' ? user : '';
+  if (next === await sessionUser()) return;
+  sessionUserValue = next;
+  try {
+    await caches.delete(API_CACHE);
+    await (await caches.open(META_CACHE)).put(SESSION_USER_KEY, new Response(next));
+  } catch (e) { /* ignore */ }
+}
+
+// LRU bookkeeping: Cache API keys() are in insertion order and put() re-appends an entry,
+// so re-putting on a hit moves it to the tail and trimming from the head evicts the least
+// recently used. Touches are throttled per URL to keep hits cheap.
+const TOUCH_INTERVAL_MS = 60 * 1000;
+const lastTouched = new Map();
 
 async function trimCache(cacheName, maxEntries) {
   try {
@@ -14,11 +85,128 @@ async function trimCache(cacheName, maxEntries) {
     if (keys.length <= maxEntries) return;
     const removeCount = keys.length - maxEntries;
     for (let i = 0; i < removeCount; i++) {
-      try { await cache.delete(keys[i]); } catch (e) { /* ignore */ }
+      try { await cache.delete(keys[i]); lastTouched.delete(keys[i].url); } catch (e) { /* ignore */ }
     }
   } catch (e) { /* ignore trimming errors */ }
 }
 
+async function touch(cacheName, request, response) {
+  const now = Date.now();
+  if (now - (lastTouched.get(request.url) || 0) < TOUCH_INTERVAL_MS) return;
+  lastTouched.set(request.url, now);
+  try {
+    const cache = await caches.open(cacheName);
+    await cache.put(request, response);
+  } catch (e) { /* ignore */ }
+}
+
+async function withCachedAt(resp) {
+  const headers = new Headers(resp.headers);
+  headers.set(CACHED_AT_HEADER, String(Date.now()));
+  const body = await resp.blob();
+  return new Response(body, { status: resp.status, statusText: resp.statusText, headers });
+}
+
+async function digest(text) {
+  try {
+    const buf = await crypto.subtle.digest('SHA-1', new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(buf)).map(b => b.toString(16).padStart(2, '0')).join('');
+  } catch (e) {
+    return String(text.length);
+  }
+}
+
+// Fetch the build manifest and make the precache hold exactly the current POS bundle URLs.
+let lastPrecacheCheck = 0;
+async function refreshPrecache() {
+  lastPrecacheCheck = Date.now();
+  try {
+    const resp = await fetch(PRECACHE_MANIFEST_URL, { cache: 'no-store' });
+    if (!resp || !resp.ok) return;
+    const text = await resp.text();
+    const version = await digest(text);
+    const cache = await caches.open(PRECACHE);
+    const stamp = await cache.match(PRECACHE_STAMP);
+    if (stamp && (await stamp.text()) === version) return;
+
+    const manifest = JSON.parse(text);
+    const urls = PRECACHE_BUNDLES.map(name => manifest[name]).filter(Boolean);
+    const wanted = new Set(urls.map(u => new URL(u, self.location.origin).href));
+    for (const url of urls) {
+      try {
+        if (!(await cache.match(url))) await cache.add(url);
+      } catch (e) { /* keep going; a missing bundle must not break the rest */ }
+    }
+    const keys = await cache.keys();
+    await Promise.all(keys
+      .filter(k => !wanted.has(k.url) && !k.url.endsWith(PRECACHE_STAMP))
+      .map(k => cache.delete(k)));
+    await cache.put(PRECACHE_STAMP, new Response(version));
+  } catch (e) { /* offline or no manifest: keep the previous precache */ }
+}
+
+async function staleWhileRevalidate(event, request, route) {
+  const cache = await caches.open(API_CACHE);
+  const cached = await cache.match(request);
+  const age = cached ? Date.now() - Number(cached.headers.get(CACHED_AT_HEADER) || 0) : Infinity;
+
+  const revalidate = async () => {
+    const resp = await fetch(request);
+    if (resp && resp.ok) {
+      try {
+        await cache.put(request, await withCachedAt(resp.clone()));
+        trimCache(API_CACHE, MAX_API_ENTRIES).catch(() => {});
+      } catch (e) { /* ignore caching errors */ }
+    }
+    return resp;
+  };
+
+  if (cached && age < route.ttl) {
+    touch(API_CACHE, request, cached.clone());
+    return cached;
+  }
+  if (cached && age < route.maxAge) {
+    event.waitUntil(revalidate().catch(() => {}));
+    return cached;
+  }
+  try {
+    return await revalidate();
+  } catch (e) {
+    if (cached) return cached;
+    return new Response('Offline', { status: 503, statusText: 'Service Unavailable' });
+  }
+}
+
+async function networkFirst(event, request, route) {
+  const cache = await caches.open(API_CACHE);
+  const network = fetch(request).then(async (resp) => {
+    if (resp && resp.ok) {
+      try {
+        await cache.put(request, await withCachedAt(resp.clone()));
+        trimCache(API_CACHE, MAX_API_ENTRIES).catch(() => {});
+      } catch (e) { /* ignore caching errors */ }
+    }
+    return resp;
+  });
+  // a slow network still refreshes the cache after we fall back
+  event.waitUntil(network.catch(() => {}));
+  let timer;
+  const timeout = new Promise((resolve) => { timer = setTimeout(() => resolve(null), route.timeoutMs); });
+  try {
+    const resp = await Promise.race([network, timeout]);
+    if (resp) return resp;
+  } catch (e) { /* offline: fall through to the cached copy */ }
+  finally { clearTimeout(timer); }
+  const cached = await cache.match(request);
+  const age = cached ? Date.now() - Number(cached.headers.get(CACHED_AT_HEADER) || 0) : Infinity;
+  if (cached && age < route.maxAge) return cached;
+  try {
+    return await network;
+  } catch (e) {
+    return new Response('Offline', { status: 503, statusText: 'Service Unavailable' });
+  }
+}
+
 self.addEventListener('install', (event) => {
   event.waitUntil((async () => {
     try {
@@ -26,6 +214,7 @@ self.addEventListener('install', (event) => {
       // addAll can fail if any resource is unavailable; guard to keep install resilient
       try { await cache.addAll(CORE_ASSETS); } catch (e) { console.warn('sw_pos: core asset pre-cache failed', e); }
     } catch (e) { /* ignore */ }
+    await refreshPrecache();
     await self.skipWaiting();
   })());
 });
@@ -33,9 +222,10 @@ self.addEventListener('install', (event) => {
 self.addEventListener('activate', (event) => {
   event.waitUntil((async () => {
     try {
+      const current = [ASSET_CACHE, API_CACHE, PRECACHE, META_CACHE];
       const keys = await caches.keys();
       const deletions = keys
-        .filter(k => k.startsWith('assets-') && k !== ASSET_CACHE)
+        .filter(k => ['assets-', 'api-', 'precache-', 'meta-'].some(p => k.startsWith(p)) && !current.includes(k))
         .map(k => caches.delete(k));
       await Promise.all(deletions);
     } catch (e) { /* ignore */ }
@@ -43,9 +233,17 @@ self.addEventListener('activate', (event) => {
   })());
 });
 
+self.addEventListener('message', (event) => {
+  const data = event.data || {};
+  if (data.type === 'pos-session-user') {
+    event.waitUntil(setSessionUser(String(data.user || '')));
+  }
+});
+
 // Strategy:
-// - API calls: network-first, fallback to cache (rare). We don't generally cache POST.
-// - Static/assets/GET: cache-first, fallback to network
+// - Safe API GETs listed in API_ROUTES: network-first with a timeout, or stale-while-revalidate.
+// - Other API calls: network-first, fallback to cache (rare). We don't generally cache POST.
+// - Static/assets/GET: cache-first (precache, then LRU asset cache), fallback to network
 self.addEventListener('fetch', (event) => {
   const { request } = event;
   const url = new URL(request.url);
@@ -64,11 +262,21 @@ self.addEventListener('fetch', (event) => {
     url.pathname.endsWith('.woff2') ||
     url.pathname.endsWith('.woff') ||
     url.pathname.endsWith('.ttf')
-  );
+  ) && url.pathname !== PRECACHE_MANIFEST_URL;
   const isAPI = url.pathname.startsWith('/api/') || url.pathname.includes('/method/');
 
-  // Network-first for API calls (don't cache POSTs). Fallback to cache if offline.
   if (isAPI) {
+    const route = sameOrigin && API_ROUTES.find(r => url.pathname.endsWith(`/method/${r.method}`));
+    if (route) {
+      event.respondWith((async () => {
+        if (!(await sessionUser())) return fetch(request);
+        return route.strategy === 'network-first'
+          ? networkFirst(event, request, route)
+          : staleWhileRevalidate(event, request, route);
+      })());
+      return;
+    }
+    // Network-first for other API calls. Fallback to cache if offline.
     event.respondWith((async () => {
       try {
         const resp = await fetch(request);
@@ -85,8 +293,13 @@ self.addEventListener('fetch', (event) => {
   // Cache-first for same-origin assets, but only cache successful responses
   if (isAsset) {
     event.respondWith((async () => {
-      const cached = await caches.match(request);
-      if (cached) return cached;
+      const precached = await (await caches.open(PRECACHE)).match(request);
+      if (precached) return precached;
+      const cached = await (await caches.open(ASSET_CACHE)).match(request);
+      if (cached) {
+        touch(ASSET_CACHE, request, cached.clone());
+        return cached;
+      }
       try {
         const resp = await fetch(request);
         if (resp && resp.ok) {
@@ -94,14 +307,13 @@ self.addEventListener('fetch', (event) => {
             const clone = resp.clone();
             const cache = await caches.open(ASSET_CACHE);
             await cache.put(request, clone);
-            // keep cache trimmed
+            lastTouched.set(request.url, Date.now());
+            // keep cache trimmed (least recently used first)
             trimCache(ASSET_CACHE, MAX_ASSET_ENTRIES).catch(() => {});
           } catch (e) { /* ignore caching errors */ }
         }
         return resp;
       } catch (e) {
-        // fallback to cached if available
-        if (cached) return cached;
         return new Response('Offline', { status: 503, statusText: 'Service Unavailable' });
       }
     })());
@@ -110,6 +322,10 @@ self.addEventListener('fetch', (event) => {
 
   // Navigation requests (HTML): try network then fallback to cache('/') or a minimal offline response
   if (request.mode === 'navigate' || (request.headers.get('accept') || '').includes('text/html')) {
+    // a new `bench build` does not update this worker, so pick up new bundle hashes here
+    if (Date.now() - lastPrecacheCheck > PRECACHE_REFRESH_MS) {
+      event.waitUntil(refreshPrecache());
+    }
     event.respondWith((async () => {
       try {
         const resp = await fetch(request);
@@ -127,5 +343,3 @@ self.addEventListener('fetch', (event) => {
   }
   // Other requests: let the browser handle them
 });
-
-